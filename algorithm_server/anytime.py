@@ -0,0 +1,111 @@
+from algorithm_server.recommendations import Recommender
+import scipy.sparse as sp
+import numpy as np
+import threading
+import time
+
+
+class Budgeted_Recommender(Recommender):
+    """
+    Recommender that stops summing item relevance scores when a deadline passes.
+
+    Only users who agree with the user on at least one co-rated movie have a nonzero similarity, so only their
+    ratings are summed. They are processed in blocks of block_size users, most similar first, and the deadline
+    is checked after each block. If it passes before every block is done, the partial sums are scaled by
+    (total similarity) / (similarity of the processed users) and the result is flagged as approximate.
+
+    One instance is meant to serve a single request; deadline is a time.monotonic() value shared by every user
+    of the request.
+
+    The deadline only bounds the relevance summation. Parsing the request, the user similarity profile,
+    normalization and ranking are not interrupted, so a response can take longer than its budget.
+    """
+
+    def __init__(self, ratings_matrix, deadline, block_size=None):
+        super().__init__(ratings_matrix)
+        self.deadline = deadline
+        self.block_size = block_size or self.block_size
+
+        #Set when at least one recommendation vector was cut short by the deadline
+        self.approximate = False
+
+        #Fraction of the total similarity weight that was processed, for each recommendation vector
+        self.coverages = []
+
+    def rated_movies_block(self, ratings_vector):
+        #Slicing columns of the csc copy only touches the users who rated those movies.
+        #The server builds the csc copy at startup, see App_Runner.set_globals
+        return self.ratings_matrix.get_movie_user_index()[:, ratings_vector.indices]
+
+    def calculate_item_relevance_sums(self, user_similarity_profile):
+        neighbors = user_similarity_profile.indices
+        similarities = user_similarity_profile.data
+
+        order = np.argsort(-similarities, kind="mergesort")
+        total_weight = similarities.sum()
+
+        sums = np.zeros(self.ratings_matrix.get_shape()[1])
+        processed_weight = 0.0
+        cut_short = False
+
+        for start in range(0, len(order), self.block_size):
+            block = order[start:start + self.block_size]
+
+            sums += self.ratings_matrix.matrix[neighbors[block]].T.dot(similarities[block])
+            processed_weight += similarities[block].sum()
+
+            if(start + self.block_size < len(order) and time.monotonic() >= self.deadline):
+                cut_short = True
+                break
+
+        if(cut_short):
+            self.approximate = True
+            sums *= total_weight / processed_weight
+            self.coverages.append(processed_weight / total_weight)
+        else:
+            self.coverages.append(1.0)
+
+        return self.ratings_matrix.to_stars(sp.csr_matrix(sums.reshape(1, -1)))
+
+    def min_coverage(self):
+        return min(self.coverages) if self.coverages else 1.0
+
+
+class Budget_Metrics:
+    """
+    Counts how often requests with a latency budget ran out of time, and how much of the similarity weight
+    they managed to process (1.0 means the exact result).
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.budget_hits = 0
+        self.coverage_sum = 0.0
+        self.min_coverage = 1.0
+        self.lock = threading.Lock()
+
+    def record(self, recommender):
+        """
+        Records the outcome of a request served by a Budgeted_Recommender.
+        Requests in which the recommender did not compute any recommendation vector are not counted.
+        """
+        if(not recommender.coverages):
+            return
+
+        coverage = recommender.min_coverage()
+
+        with self.lock:
+            self.requests += 1
+            self.budget_hits += (1 if recommender.approximate else 0)
+            self.coverage_sum += coverage
+            self.min_coverage = min(self.min_coverage, coverage)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "budget_hits": self.budget_hits,
+                "budget_hit_rate": (self.budget_hits / self.requests if self.requests > 0 else 0.0),
+                "mean_coverage": (self.coverage_sum / self.requests if self.requests > 0 else 1.0),
+                "min_coverage": self.min_coverage,
+            }
@@ -1,7 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, abort
 from algorithm_server.recommendations import *
 import algorithm_server.io_utils as io_utils
+from algorithm_server.sharding import Shard_Pool, Sharded_Recommender
+from algorithm_server.popularity import Popularity_Index
+from algorithm_server.sessions import Session_Store, Session_Recommender
+from algorithm_server.anytime import Budgeted_Recommender, Budget_Metrics
 from collections import *
+import time
 
 
 app = Flask(__name__)
@@ -10,20 +15,42 @@ app = Flask(__name__)
 class App_Runner:
 
     @classmethod
-    def set_globals(cls, datadir, log_filepath):
+    def set_globals(cls, datadir, log_filepath, rating_storage="float64", num_shards=0, budget_ms=0):
         global ratings_matrix
-        global movielens_to_imdb_bidict
-        global movielens_to_genre
-        global movielens_to_year
+        global movie_table
         global legal_genres
+        global popularity_index
+        global single_user_recommender
+        global session_store
+        global default_budget_ms
+        global budget_metrics
         global recommenders
         global logfile
 
-        ratings_matrix = io_utils.Matrix_Builder.build_matrix(datadir)
-        movielens_to_imdb_bidict = io_utils.get_movie_links_dict(datadir)
-        movielens_to_genre = io_utils.get_genre_mapping(datadir)
-        movielens_to_year = io_utils.get_year_mapping(datadir)
-        legal_genres = set().union(*[m for m in movielens_to_genre.values()])
+        ratings_matrix = io_utils.Matrix_Builder.build_matrix(datadir, rating_storage)
+        movie_table = io_utils.get_movie_id_table(datadir)
+        legal_genres = movie_table.legal_genres()
+        popularity_index = Popularity_Index.from_matrix(ratings_matrix, movie_table)
+
+        #With num_shards > 0, users are split across worker processes that each compute partial relevance sums
+        if(num_shards > 0):
+            single_user_recommender = Sharded_Recommender(ratings_matrix, Shard_Pool.start_local(ratings_matrix, num_shards))
+        else:
+            single_user_recommender = Recommender(ratings_matrix)
+
+        #Sessions and budgeted requests use a csc copy of the matrix, which takes as much memory as the matrix.
+        #With a default budget every request needs it, so it is built now rather than in the first request.
+        #Otherwise it is built by the first session or budgeted request.
+        if(num_shards == 0 and budget_ms > 0):
+            ratings_matrix.get_movie_user_index()
+
+        #Users that send a "session" id get their similarity profile updated incrementally between requests.
+        #Sessions need the whole matrix on this process, so they are not kept when users are sharded.
+        session_store = (Session_Store(ratings_matrix) if num_shards == 0 else None)
+
+        #Latency budget of requests that do not set "budget_ms", 0 means no budget
+        default_budget_ms = budget_ms
+        budget_metrics = Budget_Metrics()
 
         recommenders = {}
         recommenders["least_misery"] = Least_Misery_Recommender
@@ -32,8 +59,8 @@ class App_Runner:
         logfile = log_filepath
 
     @classmethod
-    def start_server(cls, datadir, log_filepath):
-        App_Runner.set_globals(datadir, log_filepath)
+    def start_server(cls, datadir, log_filepath, rating_storage="float64", num_shards=0, budget_ms=0):
+        App_Runner.set_globals(datadir, log_filepath, rating_storage, num_shards, budget_ms)
         app.run(debug=False)
 
 
@@ -45,27 +72,39 @@ def recommendations():
     See API doc for sample input and output.
     """
 
+    start_time = time.monotonic()
+
     json = request.get_json()
 
     method = parse_method(json)
 
-    user_ratings = io_utils.get_user_rating_list(json, movielens_to_imdb_bidict)
+    budgeted = budgeted_recommender(json, start_time)
+
+    user_ratings = io_utils.get_user_rating_list(json, movie_table)
 
     rated_movies = rated_movies_set(user_ratings)
 
-    rvc = Recommendations_Vector_Collection.from_user_ratings(ratings_matrix, user_ratings)
+    if(len(rated_movies) == 0):
+        #Nobody in the group rated anything yet, use the precomputed ranking of generally liked movies
+        scores = Movie_Scores.from_ranking(*popularity_index.cold_start_movies(parse_min_year(json)))
+    else:
+        user_recommender = budgeted or single_user_recommender
+        user_recommenders = [Session_Recommender(session_store.get_session(s), budgeted) if s is not None
+                             else user_recommender for s in parse_sessions(json)]
 
-    recommender = method(ratings_matrix)
+        rvc = Recommendations_Vector_Collection.from_user_ratings(ratings_matrix, user_ratings, user_recommenders)
 
-    group_vector = recommender.group_recommendation_vector(rvc)
+        recommender = method(ratings_matrix)
 
-    scores = Movie_Scores.from_score_vector(ratings_matrix, group_vector, rated_movies)
-    scores.filter_on_year(movielens_to_year, parse_min_year(json))
+        group_vector = recommender.group_recommendation_vector(rvc)
+
+        scores = Movie_Scores.from_score_vector(ratings_matrix, group_vector, rated_movies)
+        scores.filter_on_year(movie_table, parse_min_year(json))
 
     quantity = parse_quantity(json)
 
-    return jsonify(scores.output_as_genre_separated_keys_list(legal_genres, movielens_to_imdb_bidict, 
-                                                                                  movielens_to_genre, quantity))
+    return budgeted_response(jsonify(scores.output_as_genre_separated_keys_list(legal_genres, movie_table, quantity)),
+                             budgeted)
 
 
 @app.route('/similar_movies', methods=['POST'])
@@ -76,33 +115,110 @@ def similar_movies():
     See API doc for sample input and output.
     """
 
+    start_time = time.monotonic()
+
     json = request.get_json()
 
     min_year = parse_min_year(json)
     quantity = parse_quantity(json)
     movies = json.get('movies', [])
 
-    movielens_movies = {movielens_to_imdb_bidict.inv[m] for m in movies}
+    budgeted = budgeted_recommender(json, start_time)
+
+    movielens_movies = {movie_table.imdb_to_movielens(m) for m in movies}
 
     user_ratings = [{m: 5.0 for m in movielens_movies}]
-    genres = set.union(*[movielens_to_genre[m] for m in movielens_movies])
+    genres = set.union(*[movie_table.genres_of(m) for m in movielens_movies])
 
-    rvc = Recommendations_Vector_Collection.from_user_ratings(ratings_matrix, user_ratings)
+    rvc = Recommendations_Vector_Collection.from_user_ratings(ratings_matrix, user_ratings,
+                                                              budgeted or single_user_recommender)
 
     scores = Movie_Scores.from_score_vector(ratings_matrix, rvc.get_vector(0), set(movielens_movies))
 
-    scores.filter_on_genres(movielens_to_genre, genres)
-    scores.filter_on_year(movielens_to_year, min_year)
+    scores.filter_on_genres(movie_table, genres)
+    scores.filter_on_year(movie_table, min_year)
     scores.trim_to_top_k(quantity)
-    scores.convert_indices_to_imdb(movielens_to_imdb_bidict)
+    scores.convert_indices_to_imdb(movie_table)
 
-    return jsonify(scores.output_as_keys_list())
+    return budgeted_response(jsonify(scores.output_as_keys_list()), budgeted)
+
+
+@app.route('/popular_movies', methods=['POST'])
+def popular_movies():
+    """
+    Get the most popular movies of a genre released in or after a given year.
+
+    See API doc for sample input and output.
+    """
+
+    json = request.get_json()
+
+    movies = popularity_index.most_popular(json.get("genre", None), parse_min_year(json), parse_quantity(json))
+
+    return jsonify(movie_table.movielens_list_to_imdb(movies))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Get counters on requests served under a latency budget.
+
+    See API doc for sample output.
+    """
+
+    return jsonify({"latency_budget": budget_metrics.as_dict()})
+
+
+def budgeted_recommender(json, start_time):
+    """
+    Returns a Budgeted_Recommender if the request (or the server default) sets a latency budget, otherwise None.
+    The budget is not applied when users are sharded across worker processes.
+    """
+    budget_ms = parse_budget_ms(json)
+
+    if(not budget_ms or isinstance(single_user_recommender, Sharded_Recommender)):
+        return None
+
+    return Budgeted_Recommender(ratings_matrix, start_time + budget_ms / 1000.0)
+
+
+def budgeted_response(response, budgeted):
+    """
+    Flags responses computed under a latency budget with the X-Approximate header
+    ("true" when the budget ran out and the scores were estimated from part of the users).
+    """
+    if(budgeted is not None):
+        budget_metrics.record(budgeted)
+        response.headers["X-Approximate"] = ("true" if budgeted.approximate else "false")
+
+    return response
+
+
+def parse_budget_ms(json):
+    budget_ms = json.get("budget_ms", default_budget_ms)
+    return (float(budget_ms) if budget_ms else 0)
 
 
 def parse_quantity(json):
     return json.get("quantity", 100)
 
 
+def parse_sessions(json):
+    """
+    Session id of each user (None for users without a session). Sessions are ignored when users are sharded.
+    """
+    sessions = [u.get("session", None) for u in json["users"]]
+
+    for session in sessions:
+        if(session is not None and (isinstance(session, bool) or not isinstance(session, (str, int)))):
+            abort(400, "session must be a string or an integer")
+
+    if(session_store is None):
+        return [None] * len(sessions)
+
+    return sessions
+
+
 def parse_method(json):
     return recommenders.get(json.get("method", ""), Least_Misery_Recommender)
 
@@ -0,0 +1,177 @@
+import numpy as np
+
+
+#IMDb ids are stored as int32
+max_imdb_id = np.iinfo(np.int32).max
+
+
+class Id_Index:
+    """
+    Maps integer identifiers (e.g. MovieLens user or movie ids) to dense positions 0..n-1 and back.
+
+    ids[i] is the identifier stored at position i. The inverse direction is answered by a binary search
+    over a sorted copy of the identifiers, so the whole index is three flat integer arrays.
+    """
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.order = np.argsort(self.ids, kind="mergesort").astype(np.int32)
+        self.sorted_ids = self.ids[self.order]
+
+    @classmethod
+    def from_first_appearance(cls, identifiers):
+        """
+        Builds an index in which positions are assigned in the order identifiers first appear in the stream.
+        Returns the index along with the position of every element of identifiers.
+        """
+        identifiers = np.asarray(identifiers, dtype=np.int32)
+        unique, first, inverse = np.unique(identifiers, return_index=True, return_inverse=True)
+
+        rank = np.empty(len(unique), dtype=np.int32)
+        rank[np.argsort(first, kind="mergesort")] = np.arange(len(unique), dtype=np.int32)
+
+        return cls(unique[np.argsort(rank, kind="mergesort")]), rank[inverse.reshape(-1)]
+
+    def positions_of(self, identifiers):
+        """
+        Vectorized lookup of identifier -> position. Identifiers not in the index map to -1.
+        """
+        identifiers = np.asarray(identifiers, dtype=np.int64)
+        if(len(self.sorted_ids) == 0):
+            return np.full(identifiers.shape, -1, dtype=np.int32)
+
+        found = np.minimum(np.searchsorted(self.sorted_ids, identifiers), len(self.sorted_ids) - 1)
+        return np.where(self.sorted_ids[found] == identifiers, self.order[found], -1).astype(np.int32)
+
+    def ids_of(self, positions):
+        return self.ids[positions]
+
+    def __getitem__(self, identifier):
+        position = int(self.positions_of([int(identifier)])[0])
+        if(position < 0):
+            raise KeyError(identifier)
+        return position
+
+    def __contains__(self, identifier):
+        return self.positions_of([int(identifier)])[0] >= 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nbytes(self):
+        return self.ids.nbytes + self.order.nbytes + self.sorted_ids.nbytes
+
+
+class Movie_Id_Table:
+    """
+    Compact replacement for the movielens <-> imdb bidict and the per-movie genre and year dictionaries.
+
+    Every movie described in movies.csv or links.csv occupies one row, with rows sorted by MovieLens id.
+    Per-row attributes are stored in flat arrays: IMDb id, release year and a movie x genre boolean matrix. IMDb ids are held as integers and formatted back to "tt0000000" on output.
+    """
+
+    missing = -1
+
+    def __init__(self, movielens, imdb, years, genre_names, genre_matrix):
+        order = np.argsort(movielens, kind="mergesort")
+
+        self.movielens = np.asarray(movielens, dtype=np.int32)[order]
+        self.imdb = Id_Index(np.asarray(imdb, dtype=np.int32)[order])
+        self.years = np.asarray(years, dtype=np.int16)[order]
+        self.genre_names = list(genre_names)
+        self.genre_matrix = np.asarray(genre_matrix, dtype=bool)[order]
+
+    def rows_of(self, movielens_ids):
+        """
+        Vectorized lookup of movielens id -> table row. Unknown movies map to -1.
+        """
+        movielens_ids = np.asarray(movielens_ids, dtype=np.int64)
+        if(len(self.movielens) == 0):
+            return np.full(movielens_ids.shape, self.missing, dtype=np.int32)
+
+        found = np.minimum(np.searchsorted(self.movielens, movielens_ids), len(self.movielens) - 1)
+        return np.where(self.movielens[found] == movielens_ids, found, self.missing).astype(np.int32)
+
+    def known_rows_of(self, movielens_ids):
+        """
+        Like rows_of, but raises KeyError if any of the movies is not in the table.
+        Use this whenever the rows are used to index the per-row arrays.
+        """
+        rows = self.rows_of(movielens_ids)
+        if(np.any(rows < 0)):
+            raise KeyError(np.asarray(movielens_ids)[rows < 0][0])
+        return rows
+
+    def row_of(self, movielens_id):
+        return int(self.known_rows_of([int(movielens_id)])[0])
+
+    def has_imdb(self, imdb_id):
+        try:
+            return imdb_id_to_int(imdb_id) in self.imdb
+        except ValueError:
+            return False
+
+    def imdb_to_movielens(self, imdb_id):
+        try:
+            return int(self.movielens[self.imdb[imdb_id_to_int(imdb_id)]])
+        except ValueError:
+            raise KeyError(imdb_id)
+
+    def movielens_to_imdb(self, movielens_id):
+        return self.movielens_list_to_imdb([movielens_id])[0]
+
+    def movielens_list_to_imdb(self, movielens_ids):
+        """
+        Raises KeyError for movies that are not in the table or have no IMDb link.
+        """
+        imdb_ids = self.imdb.ids[self.known_rows_of(movielens_ids)]
+        if(np.any(imdb_ids == self.missing)):
+            raise KeyError(np.asarray(movielens_ids)[imdb_ids == self.missing][0])
+        return [int_to_imdb_id(x) for x in imdb_ids]
+
+    def genres_of(self, movielens_id):
+        row = self.row_of(movielens_id)
+        return {self.genre_names[g] for g in np.flatnonzero(self.genre_matrix[row])}
+
+    def genre_mask(self, genres):
+        """
+        Returns a boolean vector over genre_names selecting the given genre names.
+        """
+        return np.array([g in genres for g in self.genre_names], dtype=bool)
+
+    def rows_in_genres(self, rows, genres):
+        """
+        For each table row, whether the movie belongs to any of the given genres.
+        """
+        return self.genre_matrix[rows][:, self.genre_mask(genres)].any(axis=1)
+
+    def year_of(self, movielens_id):
+        return int(self.years[self.row_of(movielens_id)])
+
+    def legal_genres(self):
+        return set(self.genre_names)
+
+    def __len__(self):
+        return len(self.movielens)
+
+    def nbytes(self):
+        return self.movielens.nbytes + self.imdb.nbytes() + self.years.nbytes + self.genre_matrix.nbytes
+
+
+def imdb_id_to_int(imdb_id):
+    """
+    Converts an IMDb id of the form "tt0114709" to the integer 114709.
+    Raises ValueError for malformed ids and for ids too large to be stored in the id tables.
+    """
+    imdb_id = str(imdb_id)
+    if(not imdb_id.startswith("tt") or not imdb_id[2:].isdigit()):
+        raise ValueError("Malformed IMDb id: %s" % imdb_id)
+
+    value = int(imdb_id[2:])
+    if(value > max_imdb_id):
+        raise ValueError("IMDb id out of range: %s" % imdb_id)
+    return value
+
+
+def int_to_imdb_id(value):
+    return "tt%07d" % value
@@ -1,20 +1,25 @@
 from algorithm_server.recommendations import *
+from algorithm_server.id_tables import Id_Index, Movie_Id_Table
+from algorithm_server.popularity import Popularity_Index
 from bidict import bidict
+import numpy as np
 
 
 class Matrix_Builder:
 
     @classmethod
-    def build_matrix(cls, datadir):
-        matrix = User_Movie_Matrix(get_matrix_dimension(datadir))
+    def build_matrix(cls, datadir, rating_storage="float64"):
+        users, movies, ratings = get_ratings_arrays(datadir)
 
-        for userId, movieId, rating in get_ratings_stream(datadir):
-            matrix.add_rating(userId, movieId, float(rating))
+        user_index, rows = Id_Index.from_first_appearance(users)
+        movie_index, columns = Id_Index.from_first_appearance(movies)
+
+        matrix = User_Movie_Matrix(user_index, movie_index, rating_storage)
+        matrix.add_ratings(rows, columns, ratings)
 
         matrix.initialize_scaled_column_sums()
         matrix.initialize_top_movies()
 
-        matrix.matrix = matrix.matrix.tocsr()
         return matrix
 
 
@@ -39,6 +44,36 @@ def get_ratings_stream(datadir):
             yield tuple(str(line).strip().split(",")[:3])
 
 
+def get_ratings_arrays(datadir):
+    """
+    Reads ratings.csv into three parallel arrays: user ids, movielens movie ids and ratings.
+    """
+    users, movies, ratings = [], [], []
+
+    for user, movie, rating in get_ratings_stream(datadir):
+        users.append(int(user))
+        movies.append(int(movie))
+        ratings.append(float(rating))
+
+    return np.array(users, dtype=np.int32), np.array(movies, dtype=np.int32), np.array(ratings)
+
+
+def sample_user_ratings(ratings_matrix, num_users, ratings_per_user, seed=0):
+    """
+    Takes the ratings of randomly chosen users in the matrix as sample requests, keyed by movielens id.
+    """
+    random = np.random.RandomState(seed)
+    samples = []
+
+    for row in random.choice(ratings_matrix.get_shape()[0], num_users, replace=False):
+        user_row = ratings_matrix.getrow(row)
+        columns = user_row.indices[:ratings_per_user]
+        stars = ratings_matrix.to_stars(user_row.data[:ratings_per_user].astype(float)) - ratings_matrix.ratings_adjustment
+        samples.append({ratings_matrix.get_movielens_id(c): float(r) for c, r in zip(columns, stars)})
+
+    return samples
+
+
 def get_matrix_dimension(datadir):
     users = set()
     movies = set()
@@ -100,42 +135,85 @@ def get_genre_mapping(datadir):
     return genre_map
 
 
-def json_ratings_to_dict(json_ratings, movielens_to_imdb, field_name="rating"):
+def get_movie_id_table(datadir):
+    """
+    Returns a Movie_Id_Table holding the (movielens id) <-> (imdb id) links, genres and release years of every movie.
+    """
+    imdb = {}
+    for line in get_links_stream(datadir):
+        imdb[int(line[0])] = int(line[1])
+
+    genres = {}
+    years = {}
+    for movielens, title, genre in get_movie_description_stream(datadir):
+        genres[int(movielens)] = genre.split("|")
+        years[int(movielens)] = parse_release_year(title)
+
+    movielens_ids = sorted(set(imdb.keys()) | set(genres.keys()))
+    genre_names = sorted(set().union(*genres.values()))
+    genre_positions = {g: i for i, g in enumerate(genre_names)}
+
+    genre_matrix = np.zeros((len(movielens_ids), len(genre_names)), dtype=bool)
+    for row, movielens in enumerate(movielens_ids):
+        for genre in genres.get(movielens, []):
+            genre_matrix[row, genre_positions[genre]] = True
+
+    table = Movie_Id_Table(movielens_ids,
+                           [imdb.get(m, Movie_Id_Table.missing) for m in movielens_ids],
+                           [years.get(m, 1900) for m in movielens_ids],
+                           genre_names, genre_matrix)
+
+    return table
+
+
+def json_ratings_to_dict(json_ratings, movie_table, field_name="rating"):
     ratings = {}
     for item in json_ratings:
         imdb_id = item["imdb"]
         rating = float(item[field_name])
-        if(imdb_id in movielens_to_imdb.inv):
-            ratings[movielens_to_imdb.inv[imdb_id]] = rating
+        if(movie_table.has_imdb(imdb_id)):
+            ratings[movie_table.imdb_to_movielens(imdb_id)] = rating
 
     return ratings
 
 
-def get_user_rating_list(json_ratings, movielens_to_imdb_bidict):
-    return [json_ratings_to_dict(u["ratings"], movielens_to_imdb_bidict) for u in json_ratings["users"]]
+def get_user_rating_list(json_ratings, movie_table):
+    return [json_ratings_to_dict(u["ratings"], movie_table) for u in json_ratings["users"]]
 
 
-def get_most_popular_movies_of_genre(datadir, genre, quantity):
-    genre_map = get_genre_mapping(datadir)
+#Popularity indices already built for a data directory. They only hold per-movie arrays, not a ratings matrix.
+popularity_indices = {}
 
-    movies_of_genre = {x for x in genre_map.keys() if genre in genre_map[x]}
 
-    total_stars = {}
+def get_popularity_index(datadir):
+    """
+    Returns the Popularity_Index of a data directory, building it from the rating arrays the first time it is requested.
+    """
+    if(datadir not in popularity_indices):
+        users, movies, ratings = get_ratings_arrays(datadir)
+        popularity_indices[datadir] = Popularity_Index.from_ratings(movies, ratings, get_movie_id_table(datadir))
 
-    for uid, movie, rating in get_ratings_stream(datadir):
-        if(movie in movies_of_genre):
-            total_stars[movie] = total_stars.get(movie, 0.0) + float(rating)
+    return popularity_indices[datadir]
 
-    return list(sorted(total_stars.keys(), key=lambda x: total_stars[x], reverse=True))[:quantity]
+
+def get_most_popular_movies_of_genre(datadir, genre, quantity):
+    """
+    Returns the movielens ids (as strings) of the movies of a genre that received the most stars
+    """
+    return [str(m) for m in get_popularity_index(datadir).most_popular(genre, None, quantity)]
 
 
 def get_year_mapping(datadir):
     movielens_to_year = {}
 
     for movielens, title, genres in get_movie_description_stream(datadir):
-        try:
-            movielens_to_year[movielens] = int(title[title.rfind("(") + 1: title.rfind(")")])
-        except:
-            movielens_to_year[movielens] = 1900
+        movielens_to_year[movielens] = parse_release_year(title)
 
     return movielens_to_year
+
+
+def parse_release_year(title):
+    try:
+        return int(title[title.rfind("(") + 1: title.rfind(")")])
+    except:
+        return 1900
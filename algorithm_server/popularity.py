@@ -0,0 +1,118 @@
+import numpy as np
+from algorithm_server.id_tables import Id_Index
+
+
+class Popularity_Index:
+    """
+    Movie popularity rankings computed once when the ratings are loaded.
+
+    Movies are ranked by the total number of stars they received. Besides the overall ranking, the index holds
+    a ranking per genre and, for each release-year bucket, the rankings (overall and per genre) of the movies
+    released in or after that bucket, so that popularity queries are answered by slicing precomputed arrays.
+    It can also hold the ranking of ratings_matrix.get_top_movies(), which is used for users who have not
+    rated anything yet.
+
+    All rankings are arrays of movie columns, most popular first. When built from a User_Movie_Matrix these are
+    the columns of the matrix. Movies missing from the movie table belong to no genre and have year 0.
+    """
+
+    year_bucket_size = 10
+
+    def __init__(self, movielens, rating_totals, rating_counts, movie_table, top_movies=None):
+        self.movie_table = movie_table
+        self.movielens = np.asarray(movielens)
+
+        #per-movie totals of the stars received and number of ratings
+        self.rating_totals = np.asarray(rating_totals, dtype=float)
+        self.rating_counts = np.asarray(rating_counts)
+
+        rows = movie_table.rows_of(self.movielens)
+        known = rows >= 0
+        self.years = np.where(known, movie_table.years[rows], 0)
+
+        self.ranking = np.argsort(-self.rating_totals, kind="mergesort").astype(np.int32)
+        self.ranking = self.ranking[self.rating_counts[self.ranking] > 0]
+
+        ranked_genres = movie_table.genre_matrix[rows[self.ranking]] & known[self.ranking, np.newaxis]
+        self.genre_rankings = {genre: self.ranking[ranked_genres[:, g]] for g, genre in enumerate(movie_table.genre_names)}
+
+        #since_rankings[(genre, bucket)]: ranking of the movies of genre (None for all) released in or after bucket
+        ranked_years = self.years[self.ranking]
+        self.year_buckets = np.unique(self.year_bucket(ranked_years)).astype(int)
+        self.since_rankings = {}
+        for bucket in self.year_buckets:
+            since = ranked_years >= bucket
+            self.since_rankings[(None, bucket)] = self.ranking[since]
+            for g, genre in enumerate(movie_table.genre_names):
+                self.since_rankings[(genre, bucket)] = self.ranking[since & ranked_genres[:, g]]
+
+        if(top_movies is None):
+            self.cold_start_ranking = np.zeros(0, dtype=np.int32)
+            self.cold_start_scores = np.zeros(0)
+        else:
+            top_movies = top_movies.tocsr(copy=True)
+            top_movies.sum_duplicates()
+            top_order = np.argsort(-top_movies.data, kind="mergesort")
+            self.cold_start_ranking = top_movies.indices[top_order]
+            self.cold_start_scores = top_movies.data[top_order]
+
+    @classmethod
+    def from_matrix(cls, ratings_matrix, movie_table):
+        """
+        Index over the columns of a User_Movie_Matrix, including the cold start ranking.
+        """
+        return cls(ratings_matrix.get_movielens_ids(np.arange(ratings_matrix.get_shape()[1])),
+                   ratings_matrix.rating_totals(), ratings_matrix.ratings_per_movie, movie_table,
+                   ratings_matrix.get_top_movies())
+
+    @classmethod
+    def from_ratings(cls, movies, ratings, movie_table):
+        """
+        Index built directly from the movie and rating arrays of io_utils.get_ratings_arrays, without a matrix.
+        It has no cold start ranking.
+        """
+        movie_index, columns = Id_Index.from_first_appearance(movies)
+        num_movies = len(movie_index)
+
+        return cls(movie_index.ids_of(np.arange(num_movies)), np.bincount(columns, weights=ratings, minlength=num_movies),
+                   np.bincount(columns, minlength=num_movies), movie_table)
+
+    def year_bucket(self, years):
+        return (np.asarray(years) // self.year_bucket_size) * self.year_bucket_size
+
+    def ranked_columns(self, genre=None, min_year=None):
+        """
+        Columns of the movies of a genre released in or after min_year, most popular first.
+        Either filter may be None.
+        """
+        if(not min_year):
+            return self.genre_rankings.get(genre, np.zeros(0, dtype=np.int32)) if genre else self.ranking
+
+        #first bucket holding movies released in or after min_year
+        position = np.searchsorted(self.year_buckets, self.year_bucket(min_year))
+        if(position == len(self.year_buckets)):
+            return np.zeros(0, dtype=np.int32)
+
+        ranked = self.since_rankings.get((genre or None, int(self.year_buckets[position])), np.zeros(0, dtype=np.int32))
+
+        #only movies of the first bucket can be older than min_year
+        return ranked[self.years[ranked] >= min_year]
+
+    def most_popular(self, genre=None, min_year=None, quantity=100):
+        """
+        Movielens ids of the most popular movies of a genre released in or after min_year.
+        """
+        return self.movielens[self.ranked_columns(genre, min_year)[:quantity]]
+
+    def cold_start_movies(self, min_year=None):
+        """
+        Movielens ids and scores of ratings_matrix.get_top_movies(), best first.
+        """
+        movies = self.movielens[self.cold_start_ranking]
+        scores = self.cold_start_scores
+
+        if(min_year):
+            keep = self.years[self.cold_start_ranking] >= min_year
+            movies, scores = movies[keep], scores[keep]
+
+        return movies, scores
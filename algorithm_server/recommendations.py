@@ -1,9 +1,15 @@
 import scipy.sparse as sp
+import numpy as np
+from algorithm_server.id_tables import Id_Index
 from collections import OrderedDict
-from bidict import bidict
+import threading
 import math
 
 
+#Guards the lazy construction of User_Movie_Matrix.movie_user_index
+movie_user_index_lock = threading.Lock()
+
+
 class User_Movie_Matrix:
     """
     Data structure that contains the User-Movie ratings matrix from the MovieLens dataset.
@@ -13,18 +19,45 @@ class User_Movie_Matrix:
     #Ratings are adjusted to be in the range (-2.5, 2.0)
     ratings_adjustment = -3
 
-    def __init__(self, dimension):
+    #Star ratings given by users are clipped to the MovieLens range
+    min_rating = 0.5
+    max_rating = 5.0
+
+    #Rating storage modes: name -> (dtype of the stored ratings, number of stars in one stored unit)
+    #MovieLens ratings are half-star values, so int8 half-star units store them exactly
+    rating_storage_modes = {
+        "float64": (np.float64, 1.0),
+        "float32": (np.float32, 1.0),
+        "int8": (np.int8, 0.5),
+    }
+
+    def __init__(self, user_id_index, movie_id_index, rating_storage="float64"):
         #Map the user and movie ids from the MovieLens dataset to indices in the User-Movie matrix
-        self.user_id_index = {}
-        self.movie_id_index = bidict()
+        #Both are id_tables.Id_Index instances
+        self.user_id_index = user_id_index
+        self.movie_id_index = movie_id_index
+
+        if(rating_storage not in self.rating_storage_modes):
+            raise ValueError("Unknown rating storage mode: %s" % rating_storage)
+
+        self.rating_storage = rating_storage
+        self.rating_dtype, self.rating_unit = self.rating_storage_modes[rating_storage]
+
+        dimension = (len(user_id_index), len(movie_id_index))
 
         #matrix and vector of column sums of the matrix
-        self.matrix = sp.dok_matrix(dimension)
+        self.matrix = sp.csr_matrix(dimension, dtype=self.rating_dtype)
         self.scaled_column_sums = sp.dok_matrix((1, dimension[1]))
 
+        #number of ratings each movie received, including those stored as zero
+        self.ratings_per_movie = np.zeros(dimension[1], dtype=np.int32)
+
         #vector of the top movies for a generic user
         self.top_movies = None
 
+        #csc copy of the matrix, see get_movie_user_index()
+        self.movie_user_index = None
+
     def initialize_top_movies(self):
         user_dim = self.matrix.get_shape()[0]
 
@@ -34,7 +67,7 @@ class User_Movie_Matrix:
 
         user_similarities = user_similarities.tocsr()
 
-        self.top_movies = user_similarities.dot(self.matrix)
+        self.top_movies = self.to_stars(user_similarities.dot(self.matrix))
 
     def initialize_scaled_column_sums(self):
         for i in range(self.scaled_column_sums.get_shape()[1]):
@@ -47,11 +80,53 @@ class User_Movie_Matrix:
     def get_shape(self):
         return self.matrix.shape
 
+    def get_movie_user_index(self):
+        """
+        Returns the ratings matrix in csc format, so that the users who rated a movie (and their ratings)
+        are a contiguous slice. Built the first time it is requested, by a single thread.
+        """
+        with movie_user_index_lock:
+            if(self.movie_user_index is None):
+                self.movie_user_index = self.matrix.tocsc()
+        return self.movie_user_index
+
+    def rating_totals(self):
+        """
+        Returns the sum of the (unadjusted) star ratings received by each movie.
+        """
+        adjusted_totals = self.to_stars(np.asarray(self.matrix.sum(axis=0, dtype=float)).ravel())
+        return adjusted_totals - self.ratings_adjustment * self.ratings_per_movie
+
     def getrow(self, i):
         return self.matrix.getrow(i)
 
+    def ratings_per_user(self):
+        return np.diff(self.matrix.indptr)
+
+    def clip_ratings(self, ratings):
+        return np.clip(np.asarray(ratings, dtype=float), self.min_rating, self.max_rating)
+
+    def to_storage_units(self, adjusted_ratings):
+        """
+        Encodes adjusted ratings (in stars) into the dtype and units of the stored matrix.
+        With int8 storage, ratings are rounded to the nearest half star.
+        """
+        units = np.asarray(adjusted_ratings, dtype=float) / self.rating_unit
+        if(np.issubdtype(self.rating_dtype, np.integer)):
+            units = np.rint(units)
+        return units.astype(self.rating_dtype)
+
+    def to_stars(self, scores):
+        """
+        Converts a vector computed as a product with the stored matrix back into stars.
+        """
+        return (scores * self.rating_unit if self.rating_unit != 1.0 else scores)
+
     def get_movielens_id(self, matrix_ind):
-        return self.movie_id_index.inv[matrix_ind]
+        return int(self.movie_id_index.ids[matrix_ind])
+
+    def get_movielens_ids(self, matrix_indices):
+        return self.movie_id_index.ids_of(matrix_indices)
 
     def get_ratings_vector(self, preferences):
         """
@@ -64,26 +139,65 @@ class User_Movie_Matrix:
         Useful when we need to get user similarity profiles.
         """
 
-        vector = sp.dok_matrix((1, self.get_shape()[1]))
-        for x in preferences:
-            vector[0, self.movie_id_index[x]] = preferences[x] + self.ratings_adjustment
+        movies = list(preferences.keys())
+        columns = self.movie_id_index.positions_of(movies)
+        ratings = self.to_storage_units(self.clip_ratings([preferences[x] for x in movies]) + self.ratings_adjustment)
+
+        #Movies that nobody in the matrix has rated cannot contribute to similarities
+        known = columns >= 0
 
-        return vector.tocsr()
+        vector = sp.csr_matrix((ratings[known], (np.zeros(known.sum(), dtype=np.int32), columns[known])),
+                               shape=(1, self.get_shape()[1]), dtype=self.rating_dtype)
+        vector.eliminate_zeros()
+
+        return vector
 
     def normalize_score_vector(self, scores):
-        for i in range(scores.get_shape()[1]):
-            scores[0, i] /= self.scaled_column_sums[0, i]
-        return scores
+        """
+        Divides every entry of a 1x|M| score vector by the scaled column sums.
+        The result keeps an entry for every movie, including those with a score of zero.
+        """
+        num_movies = self.get_shape()[1]
+        normalized = scores.toarray().ravel() / self.scaled_column_sums.toarray().ravel()
+
+        return sp.csr_matrix((normalized, np.arange(num_movies, dtype=np.int32), np.array([0, num_movies], dtype=np.int32)),
+                             shape=(1, num_movies))
+
+    def add_ratings(self, rows, columns, ratings):
+        """
+        Fills the matrix from parallel arrays of matrix rows, matrix columns and (unadjusted) ratings,
+        and counts the ratings received by each movie.
+        """
+        adjusted = self.to_storage_units(np.asarray(ratings, dtype=float) + self.ratings_adjustment)
+
+        self.matrix = sp.csr_matrix((adjusted, (rows, columns)), shape=self.get_shape(), dtype=self.rating_dtype)
+        #Adjusted ratings of zero are not stored, they do not count as reviews when computing similarities
+        self.matrix.eliminate_zeros()
 
-    def add_rating(self, user, movie, rating):
-        self.update_index(self.user_id_index, user)
-        self.update_index(self.movie_id_index, movie)
-        self.scaled_column_sums[0, self.movie_id_index[movie]] += 1
-        self.matrix[self.user_id_index[user], self.movie_id_index[movie]] = rating + self.ratings_adjustment
+        self.matrix.indices = self.matrix.indices.astype(np.int32, copy=False)
+        self.matrix.indptr = self.matrix.indptr.astype(np.int32, copy=False)
 
-    def update_index(self, index, identifier):
-        if(identifier not in index):
-            index[identifier] = len(index)
+        counts = np.bincount(columns, minlength=self.get_shape()[1])
+        self.ratings_per_movie = counts.astype(np.int32)
+
+        for column in np.flatnonzero(counts):
+            self.scaled_column_sums[0, column] = counts[column]
+
+    def row_shard(self, start, stop):
+        """
+        Returns a User_Movie_Matrix holding only the users in rows [start, stop), with the same movie columns.
+        Used to split the relevance computation by user, see sharding.Shard_Pool.
+        """
+        user_ids = self.user_id_index.ids[start:stop]
+        shard = User_Movie_Matrix(Id_Index(user_ids), self.movie_id_index, self.rating_storage)
+
+        shard.matrix = self.matrix[start:stop]
+        shard.scaled_column_sums = self.scaled_column_sums
+
+        return shard
+
+    def nbytes(self):
+        return self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes
 
 
 class Aggregation_Functions:
@@ -116,6 +230,12 @@ class Recommender:
     Provides a recommendation vector for a single user.
     """
 
+    #Two ratings agree when they are within this many stars of each other
+    max_agreement_difference = 2
+
+    #Number of similar users whose reduced precision ratings are summed at once, see calculate_item_relevance_sums
+    block_size = 4096
+
     def __init__(self, ratings_matrix):
         """
         ratings_matrix is a |U|x|M| matrix composed of prior user ratings
@@ -143,12 +263,24 @@ class Recommender:
         """
         num_users, num_movies = self.ratings_matrix.get_shape()
 
-        user_similarities = sp.dok_matrix((1, num_users))
-        for i in range(num_users):
+        shared = self.rated_movies_block(ratings_vector).tocoo()
+
+        differences = np.abs(shared.data - ratings_vector.data[shared.col])
+        agreements = differences <= self.ratings_matrix.to_storage_units(self.max_agreement_difference)
 
-            user_similarities[0, i] = self.calculate_pairwise_user_similarity(self.ratings_matrix.getrow(i), ratings_vector)
+        num_agreements = np.bincount(shared.row[agreements], minlength=num_users)
+        num_shared = np.bincount(shared.row, minlength=num_users)
+        num_items = self.ratings_matrix.ratings_per_user() + ratings_vector.nnz - num_shared
 
-        return user_similarities.tocsr()
+        similarities = np.divide(num_agreements, num_items, out=np.zeros(num_users), where=num_items > 0)
+
+        return sp.csr_matrix(similarities.reshape(1, num_users))
+
+    def rated_movies_block(self, ratings_vector):
+        """
+        Returns the |U|xk block of the ratings given to the k movies in ratings_vector, in stored units
+        """
+        return self.ratings_matrix.matrix[:, ratings_vector.indices]
 
     def calculate_pairwise_user_similarity(self, user1_preferences, user2_preferences):
         """
@@ -165,7 +297,9 @@ class Recommender:
 
         all_items = set(user1_preferences.indices) | set(user2_preferences.indices)
 
-        num_agreements = sum(1 for x in shared_items if abs(user1_preferences[0, x] - user2_preferences[0, x]) <= 2)
+        max_difference = self.ratings_matrix.to_storage_units(self.max_agreement_difference)
+
+        num_agreements = sum(1 for x in shared_items if abs(user1_preferences[0, x] - user2_preferences[0, x]) <= max_difference)
 
         return (num_agreements / len(all_items) if len(all_items) > 0 else 0)
 
@@ -176,9 +310,34 @@ class Recommender:
         user_similarity_profile is a 1x|U| user similarity vector, where each entry corresponds to the similarity between
         the user we are generating recommendations for and a user entry in the ratings_matrix
         """
-        scores = user_similarity_profile.dot(self.ratings_matrix.matrix)
+        scores = self.calculate_item_relevance_sums(user_similarity_profile)
         return self.ratings_matrix.normalize_score_vector(scores)
 
+    def calculate_item_relevance_sums(self, user_similarity_profile):
+        """
+        Similarity weighted sums of the ratings (in stars) of each item, before normalization.
+        Sums over disjoint sets of users can be added together, see sharding.Shard_Pool.
+
+        float64 ratings are multiplied in place. For float32 and int8 ratings, scipy first converts the ratings
+        of the rows it multiplies to float64, so only the rows of similar users are multiplied, block_size users
+        at a time, which bounds the converted copy to one block instead of the whole matrix.
+        """
+        matrix = self.ratings_matrix.matrix
+
+        if(matrix.dtype == np.float64):
+            return self.ratings_matrix.to_stars(user_similarity_profile.dot(matrix))
+
+        neighbors = user_similarity_profile.indices
+        similarities = user_similarity_profile.data
+
+        sums = np.zeros(matrix.shape[1])
+
+        for start in range(0, len(neighbors), self.block_size):
+            block = slice(start, start + self.block_size)
+            sums += matrix[neighbors[block]].T.dot(similarities[block])
+
+        return self.ratings_matrix.to_stars(sp.csr_matrix(sums.reshape(1, -1)))
+
 
 class Group_Recommender():
 
@@ -228,13 +387,22 @@ class Disagreement_Variance_Recommender(Group_Recommender):
 class Recommendations_Vector_Collection:
 
     @classmethod
-    def from_user_ratings(cls, ratings_matrix, user_ratings_list):
-        recommender = Recommender(ratings_matrix)
+    def from_user_ratings(cls, ratings_matrix, user_ratings_list, recommender=None):
+        """
+        recommender is used for every user, or is a list with one recommender (or None for the default) per user
+        """
+        if(isinstance(recommender, list)):
+            recommenders = recommender
+        else:
+            recommenders = [recommender] * len(user_ratings_list)
+
+        default_recommender = Recommender(ratings_matrix)
 
         rvc = Recommendations_Vector_Collection()
-        for user_ratings in user_ratings_list:
+        for user_ratings, user_recommender in zip(user_ratings_list, recommenders):
             if(len(user_ratings) > 0):
-                rvc.rec_vectors.append(recommender.single_user_recommendation_vector(user_ratings))
+                user_recommender = user_recommender or default_recommender
+                rvc.rec_vectors.append(user_recommender.single_user_recommendation_vector(user_ratings))
 
         if(len(rvc) == 0):
             rvc.rec_vectors.append(ratings_matrix.get_top_movies())
@@ -263,11 +431,30 @@ class Movie_Scores:
     def from_score_vector(cls, ratings_matrix, score_vec, original_ratings):
         ms = Movie_Scores()
 
-        items = ((ratings_matrix.get_movielens_id(i), score_vec[0, i]) for i in score_vec.indices)
-        movielens_items = filter(lambda x: x[0] not in original_ratings, items)
-        movielens_items = sorted(movielens_items, key=lambda x: x[1], reverse=True)
+        score_vec = sp.csr_matrix(score_vec)
+        score_vec.sum_duplicates()
 
-        for movie, score in movielens_items:
+        movies = ratings_matrix.get_movielens_ids(score_vec.indices)
+        scores = score_vec.data
+
+        keep = ~np.isin(movies, np.fromiter(original_ratings, dtype=np.int64, count=len(original_ratings)))
+        movies, scores = movies[keep], scores[keep]
+
+        order = np.argsort(-scores, kind="mergesort")
+
+        for movie, score in zip(movies[order].tolist(), scores[order].tolist()):
+            ms.add_movie(movie, score)
+
+        return ms
+
+    @classmethod
+    def from_ranking(cls, movies, scores):
+        """
+        Builds a Movie_Scores from movielens ids and scores that are already sorted from best to worst.
+        """
+        ms = Movie_Scores()
+
+        for movie, score in zip(np.asarray(movies).tolist(), np.asarray(scores).tolist()):
             ms.add_movie(movie, score)
 
         return ms
@@ -290,65 +477,59 @@ class Movie_Scores:
 
         self.items = trimmed
 
-    def filter_on_genres(self, movielens_to_genre, genres):
+    def filter_on_genres(self, movie_table, genres):
         if(not genres or len(genres) == 0):
             return
 
-        filtered = OrderedDict()
-
-        for key in self.items.keys():
-            if(any(g in movielens_to_genre[key] for g in genres)):
-                filtered[key] = self.items[key]
-
-        self.items = filtered
+        rows = movie_table.known_rows_of(self.movie_array())
+        self.filter_on_mask(movie_table.rows_in_genres(rows, genres))
 
-    def filter_on_year(self, movielens_to_year, min_year):
+    def filter_on_year(self, movie_table, min_year):
         if(not min_year):
             return
 
+        rows = movie_table.known_rows_of(self.movie_array())
+        self.filter_on_mask(movie_table.years[rows] >= min_year)
+
+    def filter_on_mask(self, mask):
         filtered = OrderedDict()
 
-        for key in self.items.keys():
-            if(movielens_to_year[key] >= min_year):
-                filtered[key] = self.items[key]
+        for keep, item in zip(mask, self.items.items()):
+            if(keep):
+                filtered[item[0]] = item[1]
 
         self.items = filtered
 
-    def convert_indices_to_imdb(self, movie_id_mapper):
+    def movie_array(self):
+        return np.fromiter(self.items.keys(), dtype=np.int64, count=len(self.items))
+
+    def convert_indices_to_imdb(self, movie_table):
         self.id_type = "imdb"
-        items = OrderedDict()
-        for key, value in self.items.items():
-            items[movie_id_mapper[key]] = value
-        self.items = items
+        imdb_ids = movie_table.movielens_list_to_imdb(self.movie_array())
+        self.items = OrderedDict(zip(imdb_ids, self.items.values()))
 
     def output_as_keys_list(self):
         return list(self.items.keys())
 
-    def output_as_genre_separated_keys_list(self, legal_genres, movielens_to_imdb, 
-                                                  movielens_to_genre, movies_per_genre):
-        genre_dict = {genre: Movie_Scores() for genre in legal_genres}
-        genre_dict["Top"] = Movie_Scores()
-
-        full_genres = {genre: False for genre in legal_genres}
-
-        for i, item in enumerate(self.items.items()):
-            if(all(full_genres.values())):
-                break
-
-            movie, score = item
+    def output_as_genre_separated_keys_list(self, legal_genres, movie_table, movies_per_genre):
+        """
+        For each genre, and for "Top" (all genres), the imdb ids of the first movies_per_genre movies of that genre
+        """
+        movies = self.movie_array()
+        genre_matrix = movie_table.genre_matrix[movie_table.known_rows_of(movies)]
+        genre_columns = {genre: g for g, genre in enumerate(movie_table.genre_names)}
 
-            genres = movielens_to_genre[movie]
-            genres.add("Top")
-            for genre in genres:
-                if(len(genre_dict[genre]) >= movies_per_genre):
-                    full_genres[genre] = True
-                else:
-                    genre_dict[genre].add_movie(movie, score)
+        genre_dict = {}
+        for genre in legal_genres:
+            if(genre in genre_columns):
+                selected = np.flatnonzero(genre_matrix[:, genre_columns[genre]])[:movies_per_genre]
+            else:
+                selected = np.zeros(0, dtype=np.int64)
+            genre_dict[genre] = movie_table.movielens_list_to_imdb(movies[selected])
 
-        for movie_score in genre_dict.values():
-            movie_score.convert_indices_to_imdb(movielens_to_imdb)
+        genre_dict["Top"] = movie_table.movielens_list_to_imdb(movies[:movies_per_genre])
 
-        return {genre: movie_score.output_as_keys_list() for genre, movie_score in genre_dict.items()}
+        return genre_dict
 
     def output_as_scores_list(self):
         output = []
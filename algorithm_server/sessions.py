@@ -0,0 +1,189 @@
+from algorithm_server.recommendations import Recommender
+from collections import OrderedDict
+import scipy.sparse as sp
+import numpy as np
+import threading
+import time
+
+
+class Rating_Session:
+    """
+    Keeps the user similarity profile of a user who rates movies one at a time.
+
+    For every user in the ratings matrix, the session stores the number of movies both users rated (shared)
+    and the number of those they agree on, in two int32 arrays of length |U| allocated with the session
+    (8 bytes per user, see Session_Store for the limits). Adding, changing or removing one rating only updates
+    the users who rated that movie, found through User_Movie_Matrix.get_movie_user_index().
+
+    The similarities are the same as Recommender.calculate_user_similarity_profile():
+    similarity = agreements / (ratings of the user + ratings of the session user - shared)
+    """
+
+    def __init__(self, ratings_matrix):
+        self.ratings_matrix = ratings_matrix
+        self.movie_user_index = ratings_matrix.get_movie_user_index()
+
+        #(movielens id) -> (user rating), as given by the user
+        self.ratings = {}
+
+        #(matrix column) -> (adjusted rating in storage units), for the ratings that take part in similarities
+        self.stored_ratings = {}
+
+        num_users = ratings_matrix.get_shape()[0]
+
+        self.num_agreements = np.zeros(num_users, dtype=np.int32)
+        self.num_shared = np.zeros(num_users, dtype=np.int32)
+
+        self.max_difference = ratings_matrix.to_storage_units(Recommender.max_agreement_difference)
+
+        self.lock = threading.Lock()
+
+    def rate(self, movie, rating):
+        """
+        Adds or changes the rating of a movie (movielens id)
+        """
+        rating = float(self.ratings_matrix.clip_ratings(rating))
+
+        if(self.ratings.get(movie) == rating):
+            return
+
+        self.remove(movie)
+        self.ratings[movie] = rating
+
+        column = self.ratings_matrix.movie_id_index.positions_of([movie])[0]
+        stored = self.ratings_matrix.to_storage_units(rating + self.ratings_matrix.ratings_adjustment)
+
+        #Like get_ratings_vector, movies nobody rated and adjusted ratings of zero are left out
+        if(column >= 0 and stored != 0):
+            self.stored_ratings[column] = stored
+            self.update_counts(column, stored, 1)
+
+    def remove(self, movie):
+        if(movie not in self.ratings):
+            return
+
+        del self.ratings[movie]
+
+        column = self.ratings_matrix.movie_id_index.positions_of([movie])[0]
+        if(column in self.stored_ratings):
+            self.update_counts(column, self.stored_ratings.pop(column), -1)
+
+    def update_counts(self, column, stored, change):
+        start, stop = self.movie_user_index.indptr[column], self.movie_user_index.indptr[column + 1]
+        users = self.movie_user_index.indices[start:stop]
+        agreements = np.abs(self.movie_user_index.data[start:stop] - stored) <= self.max_difference
+
+        self.num_shared[users] += change
+        self.num_agreements[users[agreements]] += change
+
+    def set_ratings(self, user_ratings):
+        """
+        Applies the differences between the session and a full (movielens id) -> (user rating) mapping.
+        """
+        for movie in [m for m in self.ratings if m not in user_ratings]:
+            self.remove(movie)
+
+        for movie, rating in user_ratings.items():
+            self.rate(movie, rating)
+
+    def calculate_user_similarity_profile(self):
+        """
+        Returns the 1x|U| user similarity vector. Only users with at least one agreement have a nonzero entry.
+        """
+        num_users = self.ratings_matrix.get_shape()[0]
+
+        neighbors = np.flatnonzero(self.num_agreements)
+        num_items = (self.ratings_matrix.ratings_per_user()[neighbors] + len(self.stored_ratings) -
+                     self.num_shared[neighbors])
+
+        similarities = self.num_agreements[neighbors] / num_items
+
+        return sp.csr_matrix((similarities, (np.zeros(len(neighbors), dtype=np.int32), neighbors)), shape=(1, num_users))
+
+    def single_user_recommendation_vector(self, user_ratings, recommender=None):
+        """
+        Updates the session to user_ratings and returns the 1x|M| recommendation vector,
+        so that a session can stand in for a Recommender in Recommendations_Vector_Collection.from_user_ratings()
+
+        The item relevance scores are computed by recommender (a Recommender of the same matrix by default)
+        """
+        with self.lock:
+            self.set_ratings(user_ratings)
+            user_similarity_profile = self.calculate_user_similarity_profile()
+
+        recommender = recommender or Recommender(self.ratings_matrix)
+        return recommender.calculate_item_relevance_scores(user_similarity_profile)
+
+    def nbytes(self):
+        return self.num_agreements.nbytes + self.num_shared.nbytes
+
+
+class Session_Recommender:
+    """
+    Recommender for a session user in a request: the user similarity profile is kept up to date by the session
+    and the item relevance scores are computed by recommender (e.g. the Budgeted_Recommender of the request).
+    """
+
+    def __init__(self, session, recommender):
+        self.session = session
+        self.recommender = recommender
+
+    def single_user_recommendation_vector(self, user_ratings):
+        return self.session.single_user_recommendation_vector(user_ratings, self.recommender)
+
+
+class Session_Store:
+    """
+    Rating sessions by session id.
+
+    Sessions unused for more than ttl seconds are dropped, and the least recently used sessions are dropped
+    while all sessions together take more than max_bytes (each takes Rating_Session.nbytes(), 8 bytes per user).
+    """
+
+    def __init__(self, ratings_matrix, max_bytes=256 * 1024 * 1024, ttl=1800):
+        self.ratings_matrix = ratings_matrix
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.last_used = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get_session(self, session_id):
+        with self.lock:
+            now = time.monotonic()
+            self.drop_expired(now)
+
+            if(session_id in self.sessions):
+                self.sessions.move_to_end(session_id)
+            else:
+                session = Rating_Session(self.ratings_matrix)
+                self.sessions[session_id] = session
+                self.total_bytes += session.nbytes()
+
+                #The new session is kept even if it alone exceeds max_bytes
+                while(self.total_bytes > self.max_bytes and len(self.sessions) > 1):
+                    self.drop(next(iter(self.sessions)))
+
+            self.last_used[session_id] = now
+            return self.sessions[session_id]
+
+    def drop_expired(self, now):
+        while(self.sessions):
+            oldest = next(iter(self.sessions))
+            if(now - self.last_used[oldest] <= self.ttl):
+                return
+            self.drop(oldest)
+
+    def drop(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if(session is not None):
+            self.total_bytes -= session.nbytes()
+            del self.last_used[session_id]
+
+    def end_session(self, session_id):
+        with self.lock:
+            self.drop(session_id)
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,268 @@
+from algorithm_server.recommendations import Recommender
+from multiprocessing.connection import Listener, Client, AuthenticationError
+import multiprocessing as mp
+import scipy.sparse as sp
+import numpy as np
+import threading
+import time
+import os
+
+
+class Shard_Worker:
+    """
+    Serves the partial item relevance sums of one row shard of the User_Movie_Matrix over a socket.
+
+    Requests are tuples:
+        ("relevance", ratings_vector) -> dense array of the |M| similarity weighted rating sums over the users of the shard
+        ("shutdown",) -> stops the worker
+
+    ratings_vector is a 1x|M| sparse vector in the storage units of the shard, see User_Movie_Matrix.get_ratings_vector
+    """
+
+    def __init__(self, shard):
+        self.recommender = Recommender(shard)
+
+    def partial_relevance_sums(self, ratings_vector):
+        user_similarity_profile = self.recommender.calculate_user_similarity_profile(ratings_vector)
+        return self.recommender.calculate_item_relevance_sums(user_similarity_profile).toarray().ravel()
+
+    def serve(self, address, authkey, ready=None):
+        """
+        Listens on address until asked to shut down. Each coordinator connection is answered on its own thread,
+        so that concurrent requests are not serialized.
+        If given, the bound address is sent through the ready connection once the worker accepts connections.
+        """
+        self.stopping = threading.Event()
+
+        with Listener(address, authkey=authkey) as listener:
+            self.address = listener.address
+            self.authkey = authkey
+
+            if(ready is not None):
+                ready.send(listener.address)
+                ready.close()
+
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError, AuthenticationError):
+                    continue
+
+                if(self.stopping.is_set()):
+                    connection.close()
+                    return
+
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def handle(self, connection):
+        """
+        Answers requests on a connection until it is closed or the worker is asked to shut down.
+        """
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+
+                if(request[0] == "shutdown"):
+                    self.stopping.set()
+                    #Wakes up the accept() call of serve() so that it sees the stopping flag
+                    Client(self.address, authkey=self.authkey).close()
+                    return
+
+                try:
+                    connection.send(self.partial_relevance_sums(request[1]))
+                except Exception as e:
+                    connection.send(e)
+
+
+def run_shard_worker(shard, address, authkey, ready=None):
+    Shard_Worker(shard).serve(address, authkey, ready)
+
+
+class Shard_Error(RuntimeError):
+    """
+    Raised when a shard worker cannot be reached or stops answering.
+    """
+
+
+class Shard_Pool:
+    """
+    Coordinator side of the user sharded relevance computation.
+
+    The rows of the User_Movie_Matrix are partitioned into shards held by Shard_Worker processes.
+    A request is scattered to every shard and the partial relevance sums are gathered and added up.
+    Workers are reached through multiprocessing connections over TCP, so they do not need to run on this host.
+
+    Each request in flight uses its own set of connections (one per shard). Up to max_idle_connections idle sets
+    are kept for later requests, and a new set is opened when all of them are in use. A set whose worker stopped
+    answering is discarded and the request is retried once on a new set, so the pool recovers when the worker
+    comes back. A worker that does not answer within timeout seconds fails the request with a Shard_Error.
+    """
+
+    timeout = 30.0
+    max_idle_connections = 8
+
+    def __init__(self, addresses, authkey, processes=(), timeout=None):
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.processes = list(processes)
+        self.timeout = timeout or self.timeout
+
+        #Idle connection sets, guarded by lock
+        self.idle_connections = []
+        self.lock = threading.Lock()
+
+        self.idle_connections.append(self.open_connections())
+
+    @classmethod
+    def start_local(cls, ratings_matrix, num_shards, host="localhost"):
+        """
+        Splits ratings_matrix into num_shards contiguous row ranges and starts a local worker process for each.
+        """
+        authkey = os.urandom(16)
+        bounds = np.linspace(0, ratings_matrix.get_shape()[0], num_shards + 1).astype(int)
+
+        addresses = []
+        processes = []
+
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            ready_recv, ready_send = mp.Pipe(duplex=False)
+
+            process = mp.Process(target=run_shard_worker, daemon=True,
+                                 args=(ratings_matrix.row_shard(start, stop), (host, 0), authkey, ready_send))
+            process.start()
+            ready_send.close()
+
+            addresses.append(ready_recv.recv())
+            processes.append(process)
+
+        return cls.connect(addresses, authkey, processes)
+
+    @classmethod
+    def connect(cls, addresses, authkey, processes=(), timeout=None):
+        """
+        Connects to already running shard workers. Together, the workers must hold every row of the matrix exactly once.
+        """
+        return cls(addresses, authkey, processes, timeout)
+
+    def open_connections(self):
+        connections = []
+
+        for address in self.addresses:
+            try:
+                connections.append(Client(address, authkey=self.authkey))
+            except (OSError, EOFError) as e:
+                self.close_connections(connections)
+                raise Shard_Error("Could not connect to shard worker at %s: %s" % (address, e))
+
+        return connections
+
+    def close_connections(self, connections):
+        for connection in connections:
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+    def checkout_connections(self):
+        with self.lock:
+            if(self.idle_connections):
+                return self.idle_connections.pop()
+
+        return self.open_connections()
+
+    def checkin_connections(self, connections):
+        with self.lock:
+            if(len(self.idle_connections) < self.max_idle_connections):
+                self.idle_connections.append(connections)
+                return
+
+        self.close_connections(connections)
+
+    def scatter_gather(self, connections, ratings_vector):
+        for connection in connections:
+            connection.send(("relevance", ratings_vector))
+
+        deadline = time.monotonic() + self.timeout
+        partial_sums = []
+
+        for address, connection in zip(self.addresses, connections):
+            if(not connection.poll(max(deadline - time.monotonic(), 0))):
+                raise Shard_Error("Shard worker at %s did not answer within %g s" % (address, self.timeout))
+            partial_sums.append(connection.recv())
+
+        return partial_sums
+
+    def request(self, connections, ratings_vector):
+        """
+        Scatter-gathers on a connection set. The set goes back to the pool if every worker answered,
+        and is closed otherwise, since unread answers would be received by the next request.
+        """
+        try:
+            partial_sums = self.scatter_gather(connections, ratings_vector)
+        except BaseException:
+            self.close_connections(connections)
+            raise
+
+        self.checkin_connections(connections)
+        return partial_sums
+
+    def relevance_sums(self, ratings_vector):
+        """
+        Returns the dense 1x|M| similarity weighted rating sums over all users for a 1x|M| sparse ratings vector.
+        """
+        try:
+            partial_sums = self.request(self.checkout_connections(), ratings_vector)
+        except (EOFError, OSError):
+            #The connection set is broken, most likely because a worker died or restarted
+            try:
+                partial_sums = self.request(self.open_connections(), ratings_vector)
+            except (EOFError, OSError) as e:
+                raise Shard_Error("Shard worker stopped answering: %r" % e)
+
+        for partial in partial_sums:
+            if(isinstance(partial, Exception)):
+                raise partial
+
+        return np.sum(partial_sums, axis=0)
+
+    def shutdown(self):
+        with self.lock:
+            idle_connections, self.idle_connections = self.idle_connections, []
+
+        for connections in idle_connections:
+            self.close_connections(connections)
+
+        for address in self.addresses:
+            try:
+                with Client(address, authkey=self.authkey) as connection:
+                    connection.send(("shutdown",))
+            except (OSError, EOFError):
+                pass
+
+        for process in self.processes:
+            process.join()
+
+        self.processes = []
+
+    def __len__(self):
+        return len(self.addresses)
+
+
+class Sharded_Recommender(Recommender):
+    """
+    Recommender whose user similarity and item relevance computations are spread over a Shard_Pool.
+    """
+
+    def __init__(self, ratings_matrix, shard_pool):
+        super().__init__(ratings_matrix)
+        self.shard_pool = shard_pool
+
+    def single_user_recommendation_vector(self, user_ratings):
+        ratings_vector = self.ratings_matrix.get_ratings_vector(user_ratings)
+
+        scores = self.shard_pool.relevance_sums(ratings_vector)
+
+        return self.ratings_matrix.normalize_score_vector(sp.csr_matrix(scores.reshape(1, -1)))
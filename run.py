@@ -4,9 +4,18 @@ import algorithm_server.app as app
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--datadir', type=str, help='Data directory of movielens dataset.')
+    parser.add_argument('--rating_storage', type=str, choices=["float64", "float32", "int8"],
+                        help='Storage type of the ratings matrix. int8 stores ratings in half-star units.')
+    parser.add_argument('--num_shards', type=int,
+                        help='Number of worker processes the users of the ratings matrix are split across. 0 disables sharding.')
+    parser.add_argument('--budget_ms', type=float,
+                        help='Default latency budget of a request in milliseconds, after which approximate scores are returned. 0 disables it.')
 
-    parser.set_defaults(datadir="data/movielens/ml-latest-small", logfile="log.txt")
+    parser.set_defaults(datadir="data/movielens/ml-latest-small", logfile="log.txt", rating_storage="float64", num_shards=0, budget_ms=0)
 
     args = parser.parse_args()
 
-    app.App_Runner.start_server(args.datadir, args.logfile)
+    if(args.num_shards > 0 and args.budget_ms > 0):
+        parser.error("--budget_ms is not supported with --num_shards")
+
+    app.App_Runner.start_server(args.datadir, args.logfile, args.rating_storage, args.num_shards, args.budget_ms)
@@ -0,0 +1,54 @@
+import argparse
+import time
+import numpy as np
+import algorithm_server.io_utils as io_utils
+from algorithm_server.recommendations import *
+from algorithm_server.anytime import Budgeted_Recommender, Budget_Metrics
+
+
+def top_movies(ratings_matrix, recommender, user_ratings, quantity):
+    vector = recommender.single_user_recommendation_vector(user_ratings)
+    scores = Movie_Scores.from_score_vector(ratings_matrix, vector, set(user_ratings.keys()))
+    scores.trim_to_top_k(quantity)
+    return scores.output_as_keys_list()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datadir', type=str, help='Data directory of movielens dataset.')
+    parser.add_argument('--num_requests', type=int, help='Number of single user requests per budget.')
+    parser.add_argument('--quantity', type=int, help='Number of top movies compared against the exact result.')
+    parser.add_argument('--block_size', type=int, help='Number of users processed between deadline checks.')
+    parser.add_argument('--budgets_ms', type=float, nargs='+', help='Latency budgets to evaluate.')
+
+    parser.set_defaults(datadir="data/movielens/ml-latest", num_requests=50, quantity=100,
+                        block_size=Budgeted_Recommender.block_size, budgets_ms=[1, 5, 20, 100])
+
+    args = parser.parse_args()
+
+    ratings_matrix = io_utils.Matrix_Builder.build_matrix(args.datadir)
+    ratings_matrix.get_movie_user_index()
+
+    samples = io_utils.sample_user_ratings(ratings_matrix, args.num_requests, 20)
+
+    exact = [top_movies(ratings_matrix, Recommender(ratings_matrix), user_ratings, args.quantity) for user_ratings in samples]
+
+    print("%-10s %10s %14s %14s %14s" % ("budget ms", "hit rate", "mean coverage", "top-N overlap", "mean ms"))
+
+    for budget_ms in args.budgets_ms:
+        metrics = Budget_Metrics()
+        overlaps = []
+        elapsed = 0.0
+
+        for user_ratings, exact_top in zip(samples, exact):
+            start = time.monotonic()
+            recommender = Budgeted_Recommender(ratings_matrix, start + budget_ms / 1000.0, args.block_size)
+            approximate_top = top_movies(ratings_matrix, recommender, user_ratings, args.quantity)
+            elapsed += time.monotonic() - start
+
+            metrics.record(recommender)
+            overlaps.append(len(set(approximate_top) & set(exact_top)) / float(max(len(exact_top), 1)))
+
+        summary = metrics.as_dict()
+        print("%-10g %10.2f %14.3f %14.3f %14.2f" % (budget_ms, summary["budget_hit_rate"], summary["mean_coverage"],
+                                                     np.mean(overlaps), 1000 * elapsed / len(samples)))
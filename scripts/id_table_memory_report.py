@@ -0,0 +1,85 @@
+import argparse
+import sys
+from bidict import bidict
+import algorithm_server.io_utils as io_utils
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Approximate memory footprint of a python object, following containers.
+    """
+    seen = seen if seen is not None else set()
+    if(id(obj) in seen):
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+
+    if(isinstance(obj, bidict)):
+        size += deep_sizeof(dict(obj), seen) + deep_sizeof(dict(obj.inv), seen)
+    elif(isinstance(obj, dict)):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif(isinstance(obj, (set, frozenset, list, tuple))):
+        size += sum(deep_sizeof(x, seen) for x in obj)
+
+    return size
+
+
+def string_keyed_structures(datadir):
+    """
+    Rebuilds the string-keyed id structures that the compact id tables replace.
+    """
+    user_id_index = {}
+    movie_id_index = bidict()
+
+    for user, movie, rating in io_utils.get_ratings_stream(datadir):
+        if(user not in user_id_index):
+            user_id_index[user] = len(user_id_index)
+        if(movie not in movie_id_index):
+            movie_id_index[movie] = len(movie_id_index)
+
+    return {
+        "user_id_index": user_id_index,
+        "movie_id_index": movie_id_index,
+        "movielens_to_imdb_bidict": io_utils.get_movie_links_dict(datadir),
+        "movielens_to_genre": io_utils.get_genre_mapping(datadir),
+        "movielens_to_year": io_utils.get_year_mapping(datadir),
+    }
+
+
+def megabytes(num_bytes):
+    return num_bytes / (1024.0 * 1024.0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datadir', type=str, help='Data directory of movielens dataset.')
+
+    parser.set_defaults(datadir="data/movielens/ml-latest-small")
+
+    args = parser.parse_args()
+
+    old = string_keyed_structures(args.datadir)
+
+    ratings_matrix = io_utils.Matrix_Builder.build_matrix(args.datadir)
+    movie_table = io_utils.get_movie_id_table(args.datadir)
+
+    new = {
+        "user_id_index": ratings_matrix.user_id_index.nbytes(),
+        "movie_id_index": ratings_matrix.movie_id_index.nbytes(),
+        "movie_table": movie_table.nbytes(),
+    }
+
+    print("String-keyed structures:")
+    for name, structure in old.items():
+        print("  %-26s %10.3f MB" % (name, megabytes(deep_sizeof(structure))))
+    old_total = sum(deep_sizeof(s) for s in old.values())
+    print("  %-26s %10.3f MB" % ("total", megabytes(old_total)))
+
+    print("Compact id tables:")
+    for name, num_bytes in new.items():
+        print("  %-26s %10.3f MB" % (name, megabytes(num_bytes)))
+    new_total = sum(new.values())
+    print("  %-26s %10.3f MB" % ("total", megabytes(new_total)))
+
+    print("Reduction: %.1fx" % (old_total / float(new_total)))
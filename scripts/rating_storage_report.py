@@ -0,0 +1,50 @@
+import argparse
+import time
+import algorithm_server.io_utils as io_utils
+from algorithm_server.recommendations import *
+
+
+def top_movies(ratings_matrix, user_ratings, quantity):
+    vector = Recommender(ratings_matrix).single_user_recommendation_vector(user_ratings)
+    scores = Movie_Scores.from_score_vector(ratings_matrix, vector, set(user_ratings.keys()))
+    scores.trim_to_top_k(quantity)
+    return scores.output_as_keys_list()
+
+
+def megabytes(num_bytes):
+    return num_bytes / (1024.0 * 1024.0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datadir', type=str, help='Data directory of movielens dataset.')
+    parser.add_argument('--num_requests', type=int, help='Number of single user requests to time.')
+    parser.add_argument('--quantity', type=int, help='Number of top movies compared against float64.')
+
+    parser.set_defaults(datadir="data/movielens/ml-latest", num_requests=50, quantity=100)
+
+    args = parser.parse_args()
+
+    results = {}
+
+    for storage in ["float64", "float32", "int8"]:
+        ratings_matrix = io_utils.Matrix_Builder.build_matrix(args.datadir, storage)
+
+        if(storage == "float64"):
+            samples = io_utils.sample_user_ratings(ratings_matrix, args.num_requests, 20)
+
+        start = time.time()
+        tops = [top_movies(ratings_matrix, user_ratings, args.quantity) for user_ratings in samples]
+        elapsed = time.time() - start
+
+        results[storage] = (ratings_matrix.nbytes(), len(samples) / elapsed, tops)
+
+    base_bytes, base_throughput, base_tops = results["float64"]
+
+    print("%-8s %12s %10s %14s %10s %12s" % ("storage", "matrix MB", "saved", "requests/s", "speedup", "top-N match"))
+    for storage, (num_bytes, throughput, tops) in results.items():
+        matches = sum(1 for a, b in zip(tops, base_tops) if a == b)
+        print("%-8s %12.2f %9.0f%% %14.2f %9.2fx %7d/%d" % (storage, megabytes(num_bytes),
+                                                           100 * (1 - num_bytes / float(base_bytes)),
+                                                           throughput, throughput / base_throughput,
+                                                           matches, len(tops)))
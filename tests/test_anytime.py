@@ -0,0 +1,61 @@
+from algorithm_server import io_utils as io_utils
+from algorithm_server.recommendations import *
+from algorithm_server.anytime import Budgeted_Recommender, Budget_Metrics
+import time
+
+datadir = "data/movielens/ml-latest-small"
+
+ratings_matrix = io_utils.Matrix_Builder.build_matrix(datadir)
+
+user_ratings = {1: 5.0, 260: 4.5, 1196: 4.0, 2571: 3.0, 356: 1.5}
+
+
+def test_budget_not_hit_matches_exact_scores():
+	budgeted = Budgeted_Recommender(ratings_matrix, time.monotonic() + 60, block_size=50)
+
+	vector = budgeted.single_user_recommendation_vector(user_ratings)
+	expected = Recommender(ratings_matrix).single_user_recommendation_vector(user_ratings)
+
+	assert not budgeted.approximate
+	assert budgeted.min_coverage() == 1.0
+	assert np.allclose(vector.toarray(), expected.toarray())
+
+
+def test_expired_budget_returns_renormalized_first_block():
+	budgeted = Budgeted_Recommender(ratings_matrix, time.monotonic() - 1, block_size=50)
+
+	vector = budgeted.single_user_recommendation_vector(user_ratings)
+
+	profile = Recommender(ratings_matrix).calculate_user_similarity_profile(ratings_matrix.get_ratings_vector(user_ratings))
+	first_block = np.argsort(-profile.data, kind="mergesort")[:50]
+	processed_weight = profile.data[first_block].sum()
+	total_weight = profile.data.sum()
+
+	sums = ratings_matrix.matrix[profile.indices[first_block]].T.dot(profile.data[first_block]) * (total_weight / processed_weight)
+	expected = ratings_matrix.normalize_score_vector(ratings_matrix.to_stars(sp.csr_matrix(sums.reshape(1, -1))))
+
+	assert budgeted.approximate
+	assert len(profile.data) > 50
+	assert budgeted.min_coverage() == processed_weight / total_weight
+	assert np.allclose(vector.toarray(), expected.toarray())
+
+
+def test_budget_metrics():
+	metrics = Budget_Metrics()
+
+	exact = Budgeted_Recommender(ratings_matrix, time.monotonic() + 60)
+	exact.single_user_recommendation_vector(user_ratings)
+	metrics.record(exact)
+
+	cut_short = Budgeted_Recommender(ratings_matrix, time.monotonic() - 1, block_size=50)
+	cut_short.single_user_recommendation_vector(user_ratings)
+	metrics.record(cut_short)
+
+	#A recommender that computed no vector (e.g. a cold start request) is not counted
+	metrics.record(Budgeted_Recommender(ratings_matrix, time.monotonic() - 1))
+
+	summary = metrics.as_dict()
+	assert summary["requests"] == 2
+	assert summary["budget_hits"] == 1
+	assert summary["budget_hit_rate"] == 0.5
+	assert summary["min_coverage"] == cut_short.min_coverage()
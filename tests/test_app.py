@@ -8,7 +8,7 @@ ratings_files = ["data/sample_users/andrew.txt", "data/sample_users/galen.txt"]
 datadir = "data/movielens/ml-latest-small"
 
 client = app.app.test_client()
-app.set_globals(datadir, "log.txt")
+app.App_Runner.set_globals(datadir, "log.txt")
 
 print("Finished loading matrix")
 
@@ -36,3 +36,36 @@ def test_similar_to_childrens_movies():
 	print([title_map[x] for x in movielens_response])
 
 	assert len(imdb_response) == 100
+
+
+def post_recommendations(users, **fields):
+	request = dict(fields, quantity=10, users=users)
+	return client.post('/recommendations', data=json.dumps(request), content_type='application/json')
+
+
+def test_session_users_get_the_same_recommendations():
+	ratings = [{"rating": "5.0", "imdb": "tt0106611"}, {"rating": "3.0", "imdb": "tt0268380"}]
+
+	expected = json.loads(post_recommendations([{"ratings": ratings}]).data.decode('utf-8'))
+
+	post_recommendations([{"session": "test", "ratings": ratings[:1]}])
+	response = post_recommendations([{"session": "test", "ratings": ratings}], budget_ms=60000)
+
+	assert response.headers["X-Approximate"] == "false"
+	assert json.loads(response.data.decode('utf-8')) == expected
+
+
+def test_invalid_session_id_is_rejected():
+	ratings = [{"rating": "5.0", "imdb": "tt0106611"}]
+
+	assert post_recommendations([{"session": ["x"], "ratings": ratings}]).status_code == 400
+	assert post_recommendations([{"session": True, "ratings": ratings}]).status_code == 400
+
+
+def test_cold_start_requests_are_not_counted_in_budget_metrics():
+	requests = app.budget_metrics.as_dict()["requests"]
+
+	response = post_recommendations([{"ratings": []}], budget_ms=60000)
+
+	assert response.status_code == 200
+	assert app.budget_metrics.as_dict()["requests"] == requests
@@ -0,0 +1,64 @@
+from algorithm_server import io_utils as io_utils
+from algorithm_server.id_tables import Id_Index, Movie_Id_Table, imdb_id_to_int, int_to_imdb_id
+from algorithm_server.recommendations import Movie_Scores
+import numpy as np
+
+datadir = "data/movielens/ml-latest-small"
+
+
+def test_id_index_round_trip():
+	index, positions = Id_Index.from_first_appearance([31, 1029, 31, 7, 1029])
+
+	assert list(index.ids) == [31, 1029, 7]
+	assert list(positions) == [0, 1, 0, 2, 1]
+	assert [index[x] for x in [31, 1029, 7]] == [0, 1, 2]
+	assert list(index.positions_of([7, 8])) == [2, -1]
+	assert 8 not in index
+
+
+def test_imdb_id_formatting():
+	assert imdb_id_to_int("tt0114709") == 114709
+	assert int_to_imdb_id(114709) == "tt0114709"
+
+
+def test_movie_table_matches_string_mappings():
+	table = io_utils.get_movie_id_table(datadir)
+
+	links = io_utils.get_movie_links_dict(datadir)
+	genres = io_utils.get_genre_mapping(datadir)
+	years = io_utils.get_year_mapping(datadir)
+
+	assert all(table.movielens_to_imdb(int(m)) == imdb for m, imdb in links.items())
+	assert all(table.imdb_to_movielens(imdb) == int(m) for m, imdb in links.items())
+	assert all(table.genres_of(int(m)) == g for m, g in genres.items())
+	assert all(table.year_of(int(m)) == y for m, y in years.items())
+	assert not table.has_imdb("tt9999999999")
+	assert not table.has_imdb("not an id")
+	assert not table.has_imdb("tt" + "9" * 25)
+
+
+def test_unknown_movies_raise_key_error():
+	table = io_utils.get_movie_id_table(datadir)
+	scores = Movie_Scores()
+	scores.add_movie(999999, 1.0)
+
+	for lookup in [lambda: table.movielens_list_to_imdb([1, 999999]), lambda: table.movielens_to_imdb(999999),
+	               lambda: table.genres_of(999999), lambda: scores.filter_on_year(table, 2000),
+	               lambda: scores.filter_on_genres(table, {"Comedy"})]:
+		try:
+			lookup()
+			assert False
+		except KeyError:
+			pass
+
+
+def test_movies_without_imdb_link_raise_key_error():
+	table = Movie_Id_Table([1, 2], [114709, Movie_Id_Table.missing], [1995, 1995], ["Comedy"], [[True], [False]])
+
+	assert table.movielens_to_imdb(1) == "tt0114709"
+
+	try:
+		table.movielens_to_imdb(2)
+		assert False
+	except KeyError:
+		pass
@@ -0,0 +1,61 @@
+from algorithm_server import io_utils as io_utils
+from algorithm_server.recommendations import *
+from algorithm_server.popularity import Popularity_Index
+
+datadir = "data/movielens/ml-latest-small"
+
+ratings_matrix = io_utils.Matrix_Builder.build_matrix(datadir)
+movie_table = io_utils.get_movie_id_table(datadir)
+popularity_index = Popularity_Index.from_matrix(ratings_matrix, movie_table)
+
+
+def total_stars_ranking(genre=None, min_year=None):
+	genre_map = io_utils.get_genre_mapping(datadir)
+	year_map = io_utils.get_year_mapping(datadir)
+
+	total_stars = {}
+	for uid, movie, rating in io_utils.get_ratings_stream(datadir):
+		if((not genre or genre in genre_map[movie]) and (not min_year or year_map[movie] >= min_year)):
+			total_stars[movie] = total_stars.get(movie, 0.0) + float(rating)
+
+	return [int(m) for m in sorted(total_stars.keys(), key=lambda x: total_stars[x], reverse=True)]
+
+
+def test_popularity_rankings_match_rating_totals():
+	assert list(popularity_index.most_popular("Horror", None, 50)) == total_stars_ranking("Horror")[:50]
+	assert list(popularity_index.most_popular(None, 2006, 50)) == total_stars_ranking(None, 2006)[:50]
+	assert list(popularity_index.most_popular("Comedy", 1995, 50)) == total_stars_ranking("Comedy", 1995)[:50]
+	assert list(popularity_index.most_popular(None, None, 50)) == total_stars_ranking()[:50]
+
+
+def test_popularity_of_unknown_genre_is_empty():
+	assert len(popularity_index.most_popular("Not A Genre", None, 10)) == 0
+
+
+def test_cold_start_matches_top_movies():
+	expected = Movie_Scores.from_score_vector(ratings_matrix, ratings_matrix.get_top_movies(), set())
+	expected.filter_on_year(movie_table, 2000)
+
+	cold_start = Movie_Scores.from_ranking(*popularity_index.cold_start_movies(2000))
+
+	assert cold_start.output_as_scores_list() == expected.output_as_scores_list()
+
+
+def test_index_from_rating_arrays_matches_matrix_index():
+	users, movies, ratings = io_utils.get_ratings_arrays(datadir)
+	array_index = Popularity_Index.from_ratings(movies, ratings, io_utils.get_movie_id_table(datadir))
+
+	for genre, min_year in [(None, None), ("Horror", None), (None, 2006), ("Comedy", 1995), ("Drama", 2013)]:
+		assert list(array_index.most_popular(genre, min_year, 50)) == list(popularity_index.most_popular(genre, min_year, 50))
+
+	assert io_utils.get_most_popular_movies_of_genre(datadir, "Horror", 10) == [str(m) for m in popularity_index.most_popular("Horror", None, 10)]
+
+
+def test_movies_missing_from_table_have_no_year_or_genre():
+	table = io_utils.get_movie_id_table(datadir)
+	movies = np.array([table.movielens[0], 999999999], dtype=np.int32)
+	index = Popularity_Index.from_ratings(movies, np.array([1.0, 5.0]), table)
+
+	assert list(index.most_popular(None, None, 10)) == [999999999, table.movielens[0]]
+	assert 999999999 not in index.most_popular(None, 1800, 10)
+	assert all(999999999 not in index.most_popular(genre, None, 10) for genre in table.genre_names)
@@ -0,0 +1,87 @@
+from algorithm_server import io_utils as io_utils
+from algorithm_server.recommendations import *
+import tracemalloc
+
+datadir = "data/movielens/ml-latest-small"
+
+sample_ratings = [{1: 5.0, 260: 4.5, 1196: 4.0, 2571: 3.0, 356: 1.5}, {318: 5.0, 296: 2.0, 593: 4.0, 4993: 0.5}]
+
+matrices = {storage: io_utils.Matrix_Builder.build_matrix(datadir, storage) for storage in ["float64", "float32", "int8"]}
+
+
+def top_movies(ratings_matrix, user_ratings, quantity):
+	rvc = Recommendations_Vector_Collection.from_user_ratings(ratings_matrix, [user_ratings])
+	scores = Movie_Scores.from_score_vector(ratings_matrix, rvc.get_vector(0), set(user_ratings.keys()))
+	scores.trim_to_top_k(quantity)
+	return scores.output_as_scores_list()
+
+
+def test_reduced_precision_storage_types():
+	assert matrices["float32"].matrix.dtype == np.float32
+	assert matrices["int8"].matrix.dtype == np.int8
+	assert all(m.matrix.indices.dtype == np.int32 for m in matrices.values())
+	assert matrices["int8"].nbytes() < matrices["float32"].nbytes() < matrices["float64"].nbytes()
+
+
+def test_reduced_precision_top_movies_match_float64():
+	for user_ratings in sample_ratings:
+		expected = top_movies(matrices["float64"], user_ratings, 50)
+
+		for storage in ["float32", "int8"]:
+			assert top_movies(matrices[storage], user_ratings, 50) == expected
+
+
+def test_vectorized_similarity_matches_pairwise():
+	ratings_matrix = matrices["int8"]
+	recommender = Recommender(ratings_matrix)
+	ratings_vector = ratings_matrix.get_ratings_vector(sample_ratings[0])
+
+	profile = recommender.calculate_user_similarity_profile(ratings_vector)
+
+	for i in range(0, ratings_matrix.get_shape()[0], 37):
+		pairwise = recommender.calculate_pairwise_user_similarity(ratings_matrix.getrow(i), ratings_vector)
+		assert profile[0, i] == pairwise
+
+
+def test_out_of_range_ratings_are_clipped():
+	for ratings_matrix in matrices.values():
+		clipped = ratings_matrix.get_ratings_vector({1: 194.0, 260: -7.0})
+		expected = ratings_matrix.get_ratings_vector({1: 5.0, 260: 0.5})
+
+		assert np.array_equal(clipped.toarray(), expected.toarray())
+
+
+def test_genre_separated_keys_list():
+	ratings_matrix = matrices["float64"]
+	movie_table = io_utils.get_movie_id_table(datadir)
+	user_ratings = sample_ratings[0]
+
+	vector = Recommender(ratings_matrix).single_user_recommendation_vector(user_ratings)
+	scores = Movie_Scores.from_score_vector(ratings_matrix, vector, set(user_ratings.keys()))
+	ranked = list(scores.items.keys())
+
+	genre_lists = scores.output_as_genre_separated_keys_list(movie_table.legal_genres(), movie_table, 5)
+
+	assert genre_lists["Top"] == movie_table.movielens_list_to_imdb(ranked[:5])
+	for genre in movie_table.legal_genres():
+		expected = [m for m in ranked if genre in movie_table.genres_of(m)][:5]
+		assert genre_lists[genre] == movie_table.movielens_list_to_imdb(expected)
+
+
+def test_reduced_precision_relevance_sums_do_not_convert_the_matrix():
+	ratings_matrix = matrices["int8"]
+	recommender = Recommender(ratings_matrix)
+	recommender.block_size = 64
+
+	profile = recommender.calculate_user_similarity_profile(ratings_matrix.get_ratings_vector(sample_ratings[0]))
+	expected = ratings_matrix.to_stars(profile.dot(ratings_matrix.matrix.astype(float)))
+
+	recommender.calculate_item_relevance_sums(profile)
+	tracemalloc.start()
+	sums = recommender.calculate_item_relevance_sums(profile)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	#A float64 copy of the ratings alone would take 8 bytes per rating
+	assert peak < 8 * ratings_matrix.matrix.nnz
+	assert np.allclose(sums.toarray(), expected.toarray())
@@ -0,0 +1,71 @@
+from algorithm_server import io_utils as io_utils
+from algorithm_server.recommendations import *
+from algorithm_server.sessions import Rating_Session, Session_Store
+import time
+
+datadir = "data/movielens/ml-latest-small"
+
+ratings_matrix = io_utils.Matrix_Builder.build_matrix(datadir, "int8")
+
+
+def assert_matches_full_computation(session):
+	ratings_vector = ratings_matrix.get_ratings_vector(session.ratings)
+	expected = Recommender(ratings_matrix).calculate_user_similarity_profile(ratings_vector)
+
+	assert np.array_equal(session.calculate_user_similarity_profile().toarray(), expected.toarray())
+
+
+def test_incremental_similarities_match_full_computation():
+	session = Rating_Session(ratings_matrix)
+
+	for movie, rating in [(1, 5.0), (260, 4.5), (1196, 3.0), (2571, 1.0), (356, 2.5)]:
+		session.rate(movie, rating)
+		assert_matches_full_computation(session)
+
+	session.rate(260, 1.0)
+	assert_matches_full_computation(session)
+
+	session.rate(1196, 4.0)
+	assert_matches_full_computation(session)
+
+	session.remove(1)
+	assert_matches_full_computation(session)
+
+
+def test_session_recommendation_vector_matches_recommender():
+	user_ratings = {1: 5.0, 260: 4.5, 2571: 1.0}
+	session = Rating_Session(ratings_matrix)
+
+	session.single_user_recommendation_vector({1: 5.0, 296: 4.0})
+	vector = session.single_user_recommendation_vector(user_ratings)
+
+	expected = Recommender(ratings_matrix).single_user_recommendation_vector(user_ratings)
+
+	assert session.ratings == user_ratings
+	assert np.allclose(vector.toarray(), expected.toarray())
+
+
+def test_session_store_drops_least_recently_used():
+	session_bytes = Rating_Session(ratings_matrix).nbytes()
+	store = Session_Store(ratings_matrix, max_bytes=2 * session_bytes)
+
+	first = store.get_session("a")
+	store.get_session("b")
+	assert store.get_session("a") is first
+
+	store.get_session("c")
+	assert len(store) == 2
+	assert "b" not in store.sessions
+	assert store.total_bytes == 2 * session_bytes
+
+
+def test_session_store_drops_expired_sessions():
+	store = Session_Store(ratings_matrix, ttl=0.05)
+
+	first = store.get_session("a")
+	assert store.get_session("a") is first
+
+	time.sleep(0.1)
+	store.get_session("b")
+	assert "a" not in store.sessions
+	assert store.total_bytes == store.sessions["b"].nbytes()
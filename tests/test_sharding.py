@@ -0,0 +1,111 @@
+from algorithm_server import io_utils as io_utils
+from algorithm_server.recommendations import *
+from algorithm_server.sharding import Shard_Pool, Shard_Error, Sharded_Recommender
+import threading
+import pickle
+from multiprocessing.connection import Listener
+
+datadir = "data/movielens/ml-latest-small"
+
+user_ratings = {1: 5.0, 260: 4.5, 1196: 4.0, 2571: 3.0, 356: 1.5}
+
+
+def test_sharded_scores_match_single_process():
+	ratings_matrix = io_utils.Matrix_Builder.build_matrix(datadir, "int8")
+	shard_pool = Shard_Pool.start_local(ratings_matrix, 3)
+
+	try:
+		sharded = Sharded_Recommender(ratings_matrix, shard_pool).single_user_recommendation_vector(user_ratings)
+	finally:
+		shard_pool.shutdown()
+
+	expected = Recommender(ratings_matrix).single_user_recommendation_vector(user_ratings)
+
+	assert np.allclose(sharded.toarray(), expected.toarray())
+
+
+def test_row_shards_cover_every_user():
+	ratings_matrix = io_utils.Matrix_Builder.build_matrix(datadir)
+	num_users = ratings_matrix.get_shape()[0]
+
+	shards = [ratings_matrix.row_shard(0, 100), ratings_matrix.row_shard(100, num_users)]
+
+	assert sum(s.get_shape()[0] for s in shards) == num_users
+	assert sum(s.matrix.nnz for s in shards) == ratings_matrix.matrix.nnz
+	assert list(shards[1].user_id_index.ids) == list(ratings_matrix.user_id_index.ids[100:])
+
+
+def test_concurrent_requests_and_dead_worker():
+	ratings_matrix = io_utils.Matrix_Builder.build_matrix(datadir)
+	shard_pool = Shard_Pool.start_local(ratings_matrix, 2)
+	recommender = Sharded_Recommender(ratings_matrix, shard_pool)
+
+	expected = Recommender(ratings_matrix).single_user_recommendation_vector(user_ratings).toarray()
+	results = []
+
+	def request():
+		results.append(recommender.single_user_recommendation_vector(user_ratings).toarray())
+
+	threads = [threading.Thread(target=request) for i in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert len(results) == 4
+	assert all(np.allclose(r, expected) for r in results)
+	assert len(shard_pool.idle_connections) >= 1
+
+	shard_pool.processes[0].terminate()
+	shard_pool.processes[0].join()
+
+	for i in range(2):
+		try:
+			recommender.single_user_recommendation_vector(user_ratings)
+			assert False
+		except Shard_Error:
+			pass
+
+	shard_pool.processes = shard_pool.processes[1:]
+	shard_pool.shutdown()
+
+
+def test_hanging_worker_times_out_and_idle_sets_are_bounded():
+	listener = Listener(("localhost", 0), authkey=b"test")
+	accepted = []
+
+	def accept_without_answering():
+		while True:
+			try:
+				accepted.append(listener.accept())
+			except OSError:
+				return
+
+	threading.Thread(target=accept_without_answering, daemon=True).start()
+
+	shard_pool = Shard_Pool.connect([listener.address], b"test", timeout=0.2)
+
+	#A request that cannot be sent closes its connection set instead of leaking it
+	try:
+		shard_pool.relevance_sums(lambda: None)
+		assert False
+	except (pickle.PicklingError, AttributeError):
+		pass
+	assert len(shard_pool.idle_connections) == 0
+
+	try:
+		shard_pool.relevance_sums(sp.csr_matrix((1, 10)))
+		assert False
+	except Shard_Error:
+		pass
+
+	#The set that timed out is closed rather than returned to the pool
+	assert len(shard_pool.idle_connections) == 0
+
+	shard_pool.max_idle_connections = 2
+	for connections in [shard_pool.checkout_connections() for i in range(4)]:
+		shard_pool.checkin_connections(connections)
+	assert len(shard_pool.idle_connections) == 2
+
+	shard_pool.close_connections(sum(shard_pool.idle_connections, []))
+	listener.close()